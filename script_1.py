@@ -11,6 +11,43 @@ PyNaCl>=1.5.0
 env_template = """# Discord Bot Configuration
 BOT_TOKEN=your_bot_token_here
 GUILD_ID=your_server_id_here
+
+# Music tuning (optional)
+YTDL_CACHE_SIZE=512
+EXTRACTION_MODE=thread
+EXTRACTION_WORKERS=4
+EXTRACTION_PER_GUILD=2
+EXTRACTION_TIMEOUT=30
+PREFETCH_LEAD=15
+QUEUE_MAX_LENGTH=500
+QUEUE_MAX_PER_USER=100
+VOICE_IDLE_TIMEOUT=300
+DEFAULT_VOLUME=100
+AUDIO_CACHE_DIR=audio_cache
+AUDIO_CACHE_MAX_MB=2048
+AUDIO_CACHE_AFTER_PLAYS=3
+SNAPSHOT_FILE=queues.snapshot.json
+SONG_INDEX_FILE=song_index.json
+SONG_INDEX_SIZE=1000
+SNAPSHOT_INTERVAL=60
+
+# Prometheus metrics endpoint (optional, off when empty)
+METRICS_PORT=
+LOOP_LAG_THRESHOLD_MS=100
+
+# Moderation (optional)
+PROFANITY_DIR=profanity
+INFRACTIONS_DB=infractions.db
+STRIKE_WINDOW_HOURS=24
+SPAM_MESSAGES=6
+SPAM_INTERVAL=5
+SPAM_MENTIONS=8
+SPAM_DUPLICATES=3
+DELETE_BATCH_WINDOW=0.5
+PURGE_MAX=10000
+
+# Slash command sync (optional): global, guild or off
+COMMAND_SYNC=global
 """
 
 setup_instructions = """# Discord Bot Setup Instructions
@@ -85,28 +122,41 @@ To get Guild ID:
 ```bash
 python discord_bot_complete.py
 ```
+For big bots, `python cluster.py` runs one process per CPU core, each with its own shards.
 
 ## Features
 
 ### Music Commands
-- `/play <query>` - Play a song from YouTube
-- `/queue` - Show current music queue
+- `/play <query>` - Play a song or playlist from YouTube (suggests songs this server played before)
+- `/queue [page]` - Show the music queue, 10 songs per page with Previous/Next buttons and the total length
+- `/shuffle` - Shuffle the queue
+- `/remove <position>` - Remove a song from the queue
+- `/move <position> <destination>` - Move a song within the queue
+- `/loop <off|track|queue>` - Repeat the current song or the whole queue
+- `/volume <0-200>` - Set the music volume (100 = original)
+- `/stats` - Show track cache hit rate, gaps between songs and live voice/queue/ffmpeg counts
 - Interactive buttons: Pause, Resume, Skip, Stop
 
 ### Moderation Commands
 - `/ban <member> [reason]` - Ban a member
 - `/kick <member> [reason]` - Kick a member
 - `/timeout <member> <duration> [reason]` - Timeout a member
-- `/purge <amount>` - Delete multiple messages
+- `/purge <amount> [filters]` - Delete messages by author, text, attachments or age
 - `/warnings <member>` - Check warnings for a user
-- Auto-moderation: Profanity filter with automatic timeouts
+- Auto-moderation: Profanity and spam filters with automatic timeouts
+- `!reload <music|moderation>` - Reload that part of the bot without a restart (bot owner only)
 
 ## Architecture
 
+### Extensions
+- Music (`cogs/music.py`) and moderation (`cogs/moderation.py`) are discord.py extensions
+- Queues, strikes and other shared state live on the bot, so a reload keeps them
+- yt-dlp and the profanity word list load in the background after the bot connects
+
 ### Multi-Server Support
 - The bot uses dictionaries to track queues per server (guild)
 - Each server has its own independent music queue
-- Infractions are tracked globally per user
+- Infractions are tracked per member of each server and stored in SQLite
 
 ### Interactive Interface
 - Uses Discord UI Buttons for music controls
@@ -122,10 +172,9 @@ python discord_bot_complete.py
 ## Customization
 
 ### Add Custom Profanity Words
-```python
-from better_profanity import profanity
-profanity.add_censor_words(['word1', 'word2'])
-```
+Create `profanity/<server id>.txt` with one word per line. Prefix a word
+with `-` to allow one from the default list. Edits are picked up without
+a restart.
 
 ### Change Timeout Duration
 Edit the timeout duration in the auto-moderation section:
@@ -143,7 +192,7 @@ Change button styles in MusicControlView:
 ## Troubleshooting
 
 ### Bot doesn't respond to slash commands
-- Wait a few minutes for commands to sync
+- Wait a few minutes for commands to sync (or set COMMAND_SYNC=guild while testing)
 - Ensure bot has `applications.commands` scope
 - Check bot permissions in server settings
 
@@ -0,0 +1,1350 @@
+# Create benchmark scripts for the bot's hot paths
+
+bench_music_queue_code = """
+# MusicQueue micro-benchmarks
+# Compares the list-backed MusicQueue the bot shipped with against the
+# current music_queue.MusicQueue on 10k-entry queues.
+# Run from the directory the bot was generated into: python bench_music_queue.py
+
+import random
+import time
+
+from music_queue import LOOP_QUEUE, MusicQueue, Track
+
+SIZE = 10_000
+
+# The original queue, kept verbatim for comparison
+class LegacyMusicQueue:
+    def __init__(self):
+        self.queue = []
+        self.current = None
+        self.loop = False
+
+    def add(self, song):
+        self.queue.append(song)
+
+    def next(self):
+        if self.loop and self.current:
+            return self.current
+        if self.queue:
+            self.current = self.queue.pop(0)
+            return self.current
+        return None
+
+    def clear(self):
+        self.queue.clear()
+        self.current = None
+
+def make_tracks(count):
+    return [
+        Track({'title': f'Song {i}', 'url': f'https://example.com/{i}', 'duration': 180}, requester_id=i % 50)
+        for i in range(count)
+    ]
+
+def filled(cls, tracks):
+    queue = cls() if cls is LegacyMusicQueue else cls(max_length=len(tracks), max_per_user=len(tracks))
+    for track in tracks:
+        queue.add(track)
+    return queue
+
+def bench(label, fn, setup, number=5):
+    # setup() runs outside the timed region
+    best = float('inf')
+    for _ in range(number):
+        arg = setup()
+        start = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - start)
+    print(f'{label:<40} {best * 1000:10.3f} ms')
+    return best
+
+def main():
+    tracks = make_tracks(SIZE)
+    print(f'Queue operations on {SIZE:,} tracks (best of 5)\\n')
+
+    print('push all')
+    legacy = bench('  legacy list', lambda _: filled(LegacyMusicQueue, tracks), lambda: None)
+    current = bench('  MusicQueue', lambda _: filled(MusicQueue, tracks), lambda: None)
+    print(f'  speedup: {legacy / current:.1f}x\\n')
+
+    def drain(queue):
+        while queue.next():
+            pass
+
+    print('drain with next()')
+    legacy = bench('  legacy list', drain, lambda: filled(LegacyMusicQueue, tracks))
+    current = bench('  MusicQueue', drain, lambda: filled(MusicQueue, tracks))
+    print(f'  speedup: {legacy / current:.1f}x\\n')
+
+    # pop(0) is O(n), so the gap widens with queue length
+    big = tracks * 10
+    print(f'drain with next(), {len(big):,} tracks')
+    legacy = bench('  legacy list', drain, lambda: filled(LegacyMusicQueue, big), number=2)
+    current = bench('  MusicQueue', drain, lambda: filled(MusicQueue, big), number=2)
+    print(f'  speedup: {legacy / current:.1f}x\\n')
+
+    print('loop-queue, 10 full passes')
+    def loop_passes(queue):
+        queue.loop_mode = LOOP_QUEUE
+        for _ in range(SIZE * 10):
+            queue.next()
+    bench('  MusicQueue', loop_passes, lambda: filled(MusicQueue, tracks), number=3)
+
+    positions = [random.randrange(SIZE // 2) for _ in range(1000)]
+    print('\\n1,000 indexed removes')
+    def remove_many(queue):
+        for position in positions:
+            queue.remove(position)
+    bench('  MusicQueue', remove_many, lambda: filled(MusicQueue, tracks))
+
+    print('1,000 moves')
+    def move_many(queue):
+        for position in positions:
+            queue.move(position, SIZE - 1 - position)
+    bench('  MusicQueue', move_many, lambda: filled(MusicQueue, tracks))
+
+    print('shuffle')
+    bench('  MusicQueue', lambda queue: queue.shuffle(), lambda: filled(MusicQueue, tracks))
+
+    print('page reads (10 entries at position 9,000)')
+    queue = filled(MusicQueue, tracks)
+    bench('  MusicQueue', lambda _: queue.slice(9000, 9010), lambda: None)
+
+if __name__ == '__main__':
+    main()
+"""
+
+# Profanity filter benchmark and parity check
+
+bench_profanity_code = """
+# Profanity filter benchmark and parity check
+# Compares messages per second of better_profanity against the compiled
+# ProfanityFilter on a synthetic chat corpus, reports every message where
+# the two disagree, and times messages built to make a regex backtrack.
+# Run from the directory the bot was generated into: python bench_profanity.py
+
+import random
+import sys
+import time
+
+from better_profanity import profanity as better_profanity
+
+from profanity_filter import CHAR_VARIANTS, ProfanityFilter, default_wordlist
+
+MESSAGES = 20_000
+SWEAR_RATE = 0.05
+
+# Longest time one adversarial message may take; a backtracking pattern
+# takes seconds to minutes on these
+ADVERSARIAL_LIMIT = 0.05
+
+# Long runs of characters that stand for several letters, with and without
+# separators; 2,000 characters is Discord's message limit
+ADVERSARIAL = {
+    '"*" x 2000': '*' * 2000,
+    '"@" x 2000': '@' * 2000,
+    '"$" x 2000': '$' * 2000,
+    '"*@$" x 666': '*@$' * 666,
+    '"* " x 1000': '* ' * 1000,
+    '"@." x 1000': '@.' * 1000,
+    '"f" + "*" x 1999': 'f' + '*' * 1999,
+    '"f u" + " *" x 998': 'f u' + ' *' * 998,
+}
+
+VOCABULARY = '''
+the be to of and a in that have i it for not on with he as you do at this but
+his by from they we say her she or an will my one all would there their what so
+up out if about who get which go me when make can like time no just him know
+take people into year your good some could them see other than then now look
+only come its over think also back after use two how our work first well way
+even new want because any these give day most us is was are were been has had
+hello thanks please cool nice game play song music queue skip stop pause resume
+bot server channel voice sorry okay yeah nope sure maybe later today tomorrow
+night morning class glass pass assess title analyst therapist button document
+kitchen scrap cocktail grape lol gg wp brb afk ranked match team win lose
+'''.split()
+
+def leet(word, rng):
+    chars = []
+    for char in word:
+        variants = CHAR_VARIANTS.get(char)
+        chars.append(rng.choice(variants) if variants and rng.random() < 0.3 else char)
+    return ''.join(chars)
+
+def make_corpus(size, seed=1234):
+    rng = random.Random(seed)
+    swears = [word for word in default_wordlist() if ' ' not in word]
+    corpus = []
+    for _ in range(size):
+        words = [rng.choice(VOCABULARY) for _ in range(rng.randint(3, 20))]
+        if rng.random() < SWEAR_RATE:
+            words.insert(rng.randrange(len(words)), leet(rng.choice(swears).lower(), rng))
+        corpus.append(' '.join(words).capitalize() + rng.choice(('', '.', '!', '?', ' :)')))
+    return corpus
+
+def measure(label, check, corpus):
+    start = time.perf_counter()
+    results = [check(message) for message in corpus]
+    elapsed = time.perf_counter() - start
+    print(f'{label:<22} {len(corpus) / elapsed:12,.0f} msg/s  ({elapsed * 1e6 / len(corpus):8.1f} us/msg)')
+    return results, elapsed
+
+def main():
+    corpus = make_corpus(MESSAGES)
+    print(f'{MESSAGES:,} synthetic messages, ~{SWEAR_RATE:.0%} containing a censor word\\n')
+
+    start = time.perf_counter()
+    better_profanity.load_censor_words()
+    print(f'better_profanity load   {(time.perf_counter() - start) * 1000:8.1f} ms')
+    start = time.perf_counter()
+    compiled = ProfanityFilter()
+    print(f'ProfanityFilter compile {(time.perf_counter() - start) * 1000:8.1f} ms\\n')
+
+    # better_profanity is slow enough that a slice of the corpus is plenty
+    sample = corpus[:2_000]
+    expected, baseline = measure('better_profanity', better_profanity.contains_profanity, sample)
+    measure('ProfanityFilter', compiled.contains_profanity, corpus)
+    actual, current = measure('ProfanityFilter (same)', compiled.contains_profanity, sample)
+    print(f'\\nspeedup: {baseline / current:.0f}x')
+
+    # Parity: every default censor word, its leetspeak forms and the sample
+    words = default_wordlist()
+    missed = [word for word in words if not compiled.contains_profanity(word)]
+    rng = random.Random(99)
+    leet_missed = []
+    for word in words:
+        variant = leet(word.lower(), rng)
+        if better_profanity.contains_profanity(variant) and not compiled.contains_profanity(variant):
+            leet_missed.append(variant)
+    only_better = [message for message, a, b in zip(sample, expected, actual) if a and not b]
+    only_compiled = [message for message, a, b in zip(sample, expected, actual) if b and not a]
+
+    print('\\nparity')
+    print(f'  censor words not matched:          {len(missed)}/{len(words)}')
+    print(f'  leetspeak forms not matched:       {len(leet_missed)}/{len(words)}')
+    print(f'  messages only better_profanity hit: {len(only_better)}')
+    print(f'  messages only ProfanityFilter hit:  {len(only_compiled)} (stretched letters / split words)')
+    for message in (missed + leet_missed + only_better)[:20]:
+        print(f'    missed: {message!r}')
+    for message in only_compiled[:10]:
+        print(f'    extra:  {message!r}')
+
+    print('\\nadversarial messages')
+    slow = []
+    for label, message in ADVERSARIAL.items():
+        start = time.perf_counter()
+        compiled.contains_profanity(message)
+        elapsed = time.perf_counter() - start
+        print(f'  {label:<22} {elapsed * 1000:8.2f} ms')
+        if elapsed > ADVERSARIAL_LIMIT:
+            slow.append(label)
+    if slow:
+        print(f'  over {ADVERSARIAL_LIMIT * 1000:.0f} ms: {", ".join(slow)}')
+
+    if missed or leet_missed or only_better or slow:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
+"""
+
+# Infraction store write benchmark
+
+bench_infractions_code = """
+# Infraction store write benchmark
+# Measures sustained strikes per second through InfractionStore (cached
+# reads, write-behind batches) against the straightforward way to persist
+# the old in-memory dict: count the member's strikes in the window, insert
+# and commit, once per strike. Most strikes come from a small set of repeat
+# offenders, as in a real server.
+# Run from the directory the bot was generated into: python bench_infractions.py
+
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from infractions import SCHEMA, InfractionStore
+
+DURATION = 5.0
+GUILDS = 200
+MEMBERS_PER_GUILD = 500
+REPEAT_OFFENDERS = 2_000
+REPEAT_SHARE = 0.8
+WINDOW = 86400
+
+def random_member(rng):
+    if rng.random() < REPEAT_SHARE:
+        offender = rng.randrange(REPEAT_OFFENDERS)
+        return offender % GUILDS, offender // GUILDS
+    return rng.randrange(GUILDS), rng.randrange(MEMBERS_PER_GUILD)
+
+async def bench_store(path):
+    store = InfractionStore(path, window=WINDOW)
+    await store.open()
+    rng = random.Random(1)
+    strikes = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        # Yield to the loop now and then, like a real stream of messages would
+        for _ in range(100):
+            await store.add_strike(*random_member(rng), reason='profanity')
+            strikes += 1
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+    await store.close()
+    return strikes, elapsed, store.flushes
+
+def bench_commit_per_write(path):
+    db = sqlite3.connect(path)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.executescript(SCHEMA)
+    rng = random.Random(1)
+    strikes = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < DURATION:
+        member = random_member(rng)
+        now = time.time()
+        with db:
+            db.execute(
+                'INSERT INTO infractions (guild_id, user_id, created_at, kind, reason) VALUES (?, ?, ?, ?, ?)',
+                (*member, now, 'strike', 'profanity'),
+            )
+        db.execute(
+            'SELECT COUNT(*) FROM infractions WHERE guild_id = ? AND user_id = ? AND created_at >= ?',
+            (*member, now - WINDOW),
+        ).fetchone()
+        strikes += 1
+    elapsed = time.perf_counter() - start
+    db.close()
+    return strikes, elapsed
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        print(
+            f'Sustained strikes for {DURATION:g}s across {GUILDS * MEMBERS_PER_GUILD:,} members, '
+            f'{REPEAT_SHARE:.0%} from {REPEAT_OFFENDERS:,} repeat offenders\\n'
+        )
+
+        strikes, elapsed = bench_commit_per_write(os.path.join(directory, 'naive.db'))
+        baseline = strikes / elapsed
+        print(f'commit per strike      {baseline:12,.0f} strikes/s')
+
+        strikes, elapsed, flushes = asyncio.run(bench_store(os.path.join(directory, 'store.db')))
+        rate = strikes / elapsed
+        print(f'InfractionStore        {rate:12,.0f} strikes/s  ({flushes} batched flushes)')
+        print(f'\\nspeedup: {rate / baseline:.1f}x')
+
+        db = sqlite3.connect(os.path.join(directory, 'store.db'))
+        persisted = db.execute('SELECT COUNT(*) FROM infractions').fetchone()[0]
+        db.close()
+        print(f'rows on disk after close: {persisted:,} of {strikes:,}')
+
+if __name__ == '__main__':
+    main()
+"""
+
+# Delete queue benchmark against a fake Discord API
+
+bench_delete_queue_code = """
+# Delete queue benchmark
+# Runs a local fake of Discord's message delete endpoints, with per-channel
+# rate limit buckets that answer 429 like the real API, and points a real
+# discord.py HTTPClient at it. A raid's worth of moderation deletes is sent
+# once the old way (one DELETE per message, as soon as it's flagged) and once
+# through DeleteQueue, and the requests each needed are compared.
+# Run from the directory the bot was generated into: python bench_delete_queue.py
+
+import asyncio
+import json
+import logging
+import random
+import time
+
+import discord
+from aiohttp import web
+
+from rest_queue import BULK_MAX, BULK_MAX_AGE, DISCORD_EPOCH, DeleteQueue, message_age
+
+CHANNELS = 5
+DELETES = 1_000
+OLD_SHARE = 0.05  # messages older than 14 days, which can't be bulk deleted
+RAID_SECONDS = 1.0  # deletes arrive spread over this long
+BUCKET_LIMIT = 5  # requests per bucket per reset
+BUCKET_RESET = 0.1  # seconds
+
+class FakeDiscord:
+    def __init__(self, limit=BUCKET_LIMIT, reset=BUCKET_RESET):
+        self.limit = limit
+        self.reset = reset
+        self.requests = 0
+        self.rate_limited = 0
+        self.deleted = set()
+        self._buckets = {}  # bucket -> [remaining, resets_at]
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get('/api/v10/users/@me', self.me)
+        app.router.add_delete('/api/v10/channels/{channel}/messages/{message}', self.delete_message)
+        app.router.add_post('/api/v10/channels/{channel}/messages/bulk-delete', self.bulk_delete)
+        return app
+
+    async def me(self, request):
+        return json_response({'id': '1', 'username': 'bench', 'discriminator': '0', 'avatar': None})
+
+    async def delete_message(self, request):
+        headers = self._take(f'delete:{request.match_info["channel"]}')
+        if headers is None:
+            return self._too_many(f'delete:{request.match_info["channel"]}')
+        self.deleted.add(int(request.match_info['message']))
+        return web.Response(status=204, headers=headers)
+
+    async def bulk_delete(self, request):
+        bucket = f'bulk:{request.match_info["channel"]}'
+        headers = self._take(bucket)
+        if headers is None:
+            return self._too_many(bucket)
+        messages = [int(message_id) for message_id in (await request.json())['messages']]
+        if not 2 <= len(messages) <= BULK_MAX or any(message_age(m) >= 14 * 86400 for m in messages):
+            return json_response({'message': 'Invalid Form Body', 'code': 50034}, status=400, headers=headers)
+        self.deleted.update(messages)
+        return web.Response(status=204, headers=headers)
+
+    def _take(self, bucket):
+        self.requests += 1
+        now = time.monotonic()
+        state = self._buckets.get(bucket)
+        if state is None or now >= state[1]:
+            state = self._buckets[bucket] = [self.limit, now + self.reset]
+        if state[0] == 0:
+            return None
+        state[0] -= 1
+        return {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(state[0]),
+            'X-RateLimit-Reset-After': f'{state[1] - now:.3f}',
+            'X-RateLimit-Bucket': bucket.split(':')[0],
+        }
+
+    def _too_many(self, bucket):
+        self.rate_limited += 1
+        retry_after = max(self._buckets[bucket][1] - time.monotonic(), 0.001)
+        return json_response(
+            {'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': False},
+            status=429,
+            headers={
+                'Via': '1.1 google',
+                'X-RateLimit-Limit': str(self.limit),
+                'X-RateLimit-Remaining': '0',
+                'X-RateLimit-Reset-After': f'{retry_after:.3f}',
+            },
+        )
+
+def json_response(payload, status=200, headers=None):
+    # discord.py only parses bodies typed exactly application/json, which
+    # aiohttp's json_response doesn't send (it appends a charset)
+    return web.Response(
+        body=json.dumps(payload).encode(), status=status,
+        headers={**(headers or {}), 'Content-Type': 'application/json'},
+    )
+
+def make_workload(seed=7):
+    rng = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    old_ms = now_ms - int((BULK_MAX_AGE + 86400) * 1000)
+    workload = []
+    for sequence in range(DELETES):
+        created = old_ms if rng.random() < OLD_SHARE else now_ms - rng.randrange(60_000)
+        message_id = ((created - DISCORD_EPOCH) << 22) | sequence
+        workload.append((rng.uniform(0, RAID_SECONDS), 1000 + rng.randrange(CHANNELS), message_id))
+    workload.sort()
+    return workload
+
+async def replay(workload, delete):
+    # Calls delete(channel_id, message_id) at each message's arrival time
+    start = time.monotonic()
+    pending = []
+    for at, channel_id, message_id in workload:
+        delay = start + at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        pending.append(delete(channel_id, message_id))
+    return await asyncio.gather(*pending, return_exceptions=True)
+
+async def run(label, workload, make_delete):
+    fake = FakeDiscord()
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    discord.http.Route.BASE = f'http://127.0.0.1:{port}/api/v10'
+
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    await http.static_login('bench-token')
+    fake.requests = 0
+
+    delete, finish = make_delete(http)
+    start = time.perf_counter()
+    await replay(workload, delete)
+    await finish()
+    elapsed = time.perf_counter() - start
+
+    await http.close()
+    await runner.cleanup()
+    missing = len({message_id for _, _, message_id in workload} - fake.deleted)
+    print(
+        f'{label:<22} {fake.requests:6,} requests  {fake.rate_limited:5,} x 429  '
+        f'{elapsed:6.2f}s to clear  ({missing} not deleted)'
+    )
+    return fake.requests
+
+def one_request_each(http):
+    async def delete(channel_id, message_id):
+        try:
+            await http.delete_message(channel_id, message_id)
+        except discord.HTTPException:
+            pass
+
+    async def finish():
+        pass
+
+    return lambda channel_id, message_id: asyncio.ensure_future(delete(channel_id, message_id)), finish
+
+def delete_queue(http):
+    queue = DeleteQueue(http)
+    return queue.delete, queue.close
+
+async def main():
+    # discord.py logs every 429 it retries; the counts below are enough
+    logging.getLogger('discord.http').setLevel(logging.ERROR)
+    workload = make_workload()
+    print(
+        f'{DELETES:,} deletes over {RAID_SECONDS:g}s in {CHANNELS} channels, {OLD_SHARE:.0%} older than 14 days; '
+        f'buckets allow {BUCKET_LIMIT} requests per {BUCKET_RESET:g}s per channel\\n'
+    )
+    baseline = await run('one DELETE per message', workload, one_request_each)
+    batched = await run('DeleteQueue', workload, delete_queue)
+    print(f'\\nrequests saved: {baseline - batched:,} ({1 - batched / baseline:.0%})')
+
+if __name__ == '__main__':
+    asyncio.run(main())
+"""
+
+# Purge benchmark against the fake Discord API
+
+bench_purge_code = """
+# Purge benchmark
+# Purges a 10k-message channel on the fake Discord API from
+# bench_delete_queue.py (same per-channel rate limit buckets, plus a history
+# endpoint and some network latency). Compares fetching a page and then
+# deleting it, one after the other, with PurgeJob, which deletes each batch
+# while the next page is fetched. Also reports peak memory at two channel
+# sizes to show it stays flat.
+# Run from the directory the bot was generated into: python bench_purge.py
+
+import asyncio
+import logging
+import time
+import tracemalloc
+
+import discord
+from aiohttp import web
+
+from bench_delete_queue import FakeDiscord, json_response
+from purge_engine import PAGE_SIZE, PurgeJob, message_filter
+from rest_queue import DISCORD_EPOCH
+
+CHANNEL = 1000
+MESSAGES = 10_000
+LATENCY = 0.05  # seconds per request
+BUCKET_LIMIT = 5  # requests per bucket per reset
+BUCKET_RESET = 0.25  # seconds
+
+class FakeChannel(FakeDiscord):
+    def __init__(self, size):
+        super().__init__(BUCKET_LIMIT, BUCKET_RESET)
+        # Message ids only, newest first; payloads are built per request
+        now_ms = int(time.time() * 1000)
+        self.ids = [((now_ms - DISCORD_EPOCH - index * 1000) << 22) for index in range(size)]
+
+    def app(self):
+        app = super().app()
+        app.router.add_get('/api/v10/channels/{channel}/messages', self.history)
+        return app
+
+    async def history(self, request):
+        await asyncio.sleep(LATENCY)
+        headers = self._take(f'history:{request.match_info["channel"]}')
+        if headers is None:
+            return self._too_many(f'history:{request.match_info["channel"]}')
+        limit = min(int(request.query.get('limit', 50)), PAGE_SIZE)
+        before = int(request.query.get('before', 1 << 63))
+        page = [message_id for message_id in self.ids if message_id < before and message_id not in self.deleted][:limit]
+        return json_response([self.payload(message_id) for message_id in page], headers=headers)
+
+    async def bulk_delete(self, request):
+        await asyncio.sleep(LATENCY)
+        return await super().bulk_delete(request)
+
+    def payload(self, message_id):
+        raider = message_id % 7 == 0
+        return {
+            'id': str(message_id),
+            'channel_id': str(CHANNEL),
+            'author': {'id': '666' if raider else '42', 'username': 'user'},
+            'content': 'join my server discord.gg/spam' if raider else 'hello there',
+            'attachments': [],
+        }
+
+async def serve(fake):
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    discord.http.Route.BASE = f'http://127.0.0.1:{port}/api/v10'
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    await http.static_login('bench-token')
+    return runner, http
+
+async def fetch_then_delete(http, limit):
+    # What running /purge 100 at a time amounts to: nothing overlaps
+    before = None
+    deleted = 0
+    for _ in range(0, limit, PAGE_SIZE):
+        page = await http.logs_from(CHANNEL, PAGE_SIZE, before=before)
+        if not page:
+            break
+        ids = [int(message['id']) for message in page]
+        await http.delete_messages(CHANNEL, ids)
+        deleted += len(ids)
+        before = ids[-1]
+    return deleted
+
+async def run(label, size, purge):
+    fake = FakeChannel(size)
+    runner, http = await serve(fake)
+    tracemalloc.start()
+    start = time.perf_counter()
+    deleted = await purge(http, size)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    await http.close()
+    await runner.cleanup()
+    print(
+        f'{label:<34} {deleted:7,} deleted  {elapsed:6.2f}s  {fake.requests:4} requests  '
+        f'{fake.rate_limited:3} x 429  peak {peak / 1e6:5.1f} MB'
+    )
+    return elapsed
+
+async def pipelined(http, limit):
+    return (await PurgeJob(http, CHANNEL, limit=limit).run()).deleted
+
+async def filtered(http, limit):
+    matcher = message_filter(author_id=666, pattern=r'discord\\.gg/')
+    return (await PurgeJob(http, CHANNEL, limit=limit, matcher=matcher).run()).deleted
+
+async def main():
+    logging.getLogger('discord.http').setLevel(logging.ERROR)
+    print(
+        f'{LATENCY * 1000:g} ms per request; buckets allow {BUCKET_LIMIT} requests '
+        f'per {BUCKET_RESET:g}s per route and channel\\n'
+    )
+    baseline = await run('fetch page, then delete it', MESSAGES, fetch_then_delete)
+    current = await run('PurgeJob (pipelined)', MESSAGES, pipelined)
+    await run('PurgeJob, 2k channel', MESSAGES // 5, pipelined)
+    await run('PurgeJob, raider + link filter', MESSAGES, filtered)
+    print(f'\\nspeedup: {baseline / current:.1f}x')
+
+if __name__ == '__main__':
+    asyncio.run(main())
+"""
+
+# Audio path CPU-per-stream benchmark
+
+bench_audio_code = """
+# Audio path CPU benchmark
+# Generates local test songs with ffmpeg (an Opus WebM like most YouTube
+# audio, and an AAC M4A), then reads every 20 ms frame of each through the
+# old PCM path and the Opus paths in audio.py, as fast as possible. CPU time
+# of the bot process plus its ffmpeg child per second of audio gives the
+# number of concurrent voice streams one core can keep up with.
+# Needs ffmpeg on PATH, and libopus for the old path's in-process encoding
+# (set OPUS_LIBRARY=/path/to/libopus.so if it isn't found automatically).
+# Run from the directory the bot was generated into: python bench_audio.py
+
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import discord
+
+from audio import OpusTrackSource
+
+SONG_SECONDS = 60
+REPEATS = 3
+
+def make_song(directory, name, codec_args):
+    path = os.path.join(directory, name)
+    subprocess.run(
+        ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', f'anoisesrc=d={SONG_SECONDS}:c=pink:a=0.3',
+         '-ac', '2', '-ar', '48000', *codec_args, path],
+        check=True,
+    )
+    return path
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+def legacy_source(path):
+    # What YTDLSource used to be: PCM out of ffmpeg, volume scaled in Python
+    return discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(path, options='-vn'), volume=0.5)
+
+def measure(label, make_source, encoder=None):
+    audio_seconds = 0.0
+    (bot_before, ffmpeg_before), wall_before = cpu_seconds(), time.perf_counter()
+    for _ in range(REPEATS):
+        source = make_source()
+        frames = 0
+        while True:
+            frame = source.read()
+            if not frame:
+                break
+            if encoder is not None and not source.is_opus():
+                # discord.py encodes PCM to Opus in the bot process
+                encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+            frames += 1
+        source.cleanup()  # reaps ffmpeg, so its CPU time is counted
+        audio_seconds += frames * 0.02
+    (bot_after, ffmpeg_after), wall = cpu_seconds(), time.perf_counter() - wall_before
+
+    bot_cpu = (bot_after - bot_before) / audio_seconds
+    ffmpeg_cpu = (ffmpeg_after - ffmpeg_before) / audio_seconds
+    total = bot_cpu + ffmpeg_cpu
+    print(
+        f'{label:<34} bot {bot_cpu * 100:6.2f}%  ffmpeg {ffmpeg_cpu * 100:6.2f}%  '
+        f'-> {1 / total:7.0f} streams/core  ({audio_seconds / wall:5.0f}x realtime)'
+    )
+    return total
+
+def main():
+    if shutil.which('ffmpeg') is None:
+        sys.exit('ffmpeg was not found on PATH')
+    encoder = None
+    if os.getenv('OPUS_LIBRARY'):
+        discord.opus.load_opus(os.environ['OPUS_LIBRARY'])
+    if discord.opus.is_loaded() or discord.opus._load_default():
+        encoder = discord.opus.Encoder()
+    else:
+        print('libopus not found: the PCM path is measured without its Opus encoding, so it looks cheaper than it is\\n')
+
+    with tempfile.TemporaryDirectory() as directory:
+        webm = make_song(directory, 'song.webm', ['-c:a', 'libopus', '-b:a', '128k'])
+        m4a = make_song(directory, 'song.m4a', ['-c:a', 'aac', '-b:a', '128k'])
+        print(f'{REPEATS} x {SONG_SECONDS}s songs per path; CPU per second of audio\\n')
+
+        baseline = measure('PCM + Python volume (old)', lambda: legacy_source(webm), encoder)
+        passthrough = measure('Opus passthrough (100%)', lambda: OpusTrackSource(webm, codec='opus', stream=False))
+        measure('ffmpeg Opus + volume filter (50%)', lambda: OpusTrackSource(webm, codec='opus', volume=0.5, stream=False))
+        measure('ffmpeg Opus from AAC (100%)', lambda: OpusTrackSource(m4a, codec='aac', stream=False))
+        print(f'\\npassthrough uses {baseline / passthrough:.0f}x less CPU per stream than the old path')
+
+if __name__ == '__main__':
+    main()
+"""
+
+# Offline load test of the bot handlers
+
+bench_load_code = """
+# Offline load test
+# Drives the bot's real handlers (/play, /queue, the music control buttons,
+# on_message moderation and the moderation commands) for N simulated servers
+# with fake interactions and messages, a stub YoutubeDL that answers from a
+# made-up song catalog, ffmpeg replaced by a silent source and voice clients
+# that play into nothing. Nothing touches the network or Discord.
+# Events arrive at a fixed rate whether or not the bot keeps up, and latency
+# is measured from when each event was due, so an overloaded event loop
+# shows up as queueing in p99 instead of a lower arrival rate. The bot's
+# event loop watchdog runs as well and lists whatever blocked the loop.
+# Run from the directory the bot was generated into: python bench_load.py
+#   --guilds 100 --messages 1000 --commands 50 --seconds 10 [--max-p99 250]
+
+import argparse
+import asyncio
+import gc
+import hashlib
+import itertools
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+import traceback
+from collections import defaultdict
+from types import SimpleNamespace
+
+import discord
+import yt_dlp
+
+CATALOG = 300  # distinct songs; popular ones are requested far more often
+EXTRACT_SECONDS = 0.05  # simulated YouTube lookup time, spent on the extraction pool
+HTTP_SECONDS = 0.02  # simulated Discord REST latency
+PROFANE_SHARE = 0.02
+SPAMMER_SHARE = 0.01  # members who flood the channel every time they talk
+
+# ---- Stubs for the outside world, installed before the bot is imported ----
+
+class StubYoutubeDL:
+    def __init__(self, options=None):
+        self.options = options or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def extract_info(self, query, download=False, process=True):
+        time.sleep(EXTRACT_SECONDS)
+        song = query.split(':', 1)[-1]
+        video_id = hashlib.sha1(song.encode()).hexdigest()[:11]
+        info = {
+            'id': video_id,
+            'extractor': 'youtube',
+            'extractor_key': 'Youtube',
+            'title': f'Song {song}',
+            'url': f'https://stream.invalid/{video_id}.webm',
+            'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+            'duration': 180,
+            'ext': 'webm',
+            'acodec': 'opus',
+        }
+        return {'entries': [info]} if query.startswith('ytsearch:') else info
+
+    def prepare_filename(self, info):
+        return f"{info['id']}.{info['ext']}"
+
+class SilentAudio(discord.AudioSource):
+    # Stands in for FFmpegOpusAudio, so no ffmpeg is started
+    def __init__(self, source, **kwargs):
+        self.source = source
+
+    def read(self):
+        return b''
+
+    def is_opus(self):
+        return True
+
+class NullVoiceClient:
+    def __init__(self, guild, channel):
+        self.guild = guild
+        self.channel = channel
+        self.source = None
+        self._after = None
+        self._paused = False
+
+    def play(self, source, *, after=None):
+        if self.source is not None:
+            raise discord.ClientException('Already playing audio.')  # like discord.py
+        self.source = source
+        self._after = after
+        self._paused = False
+
+    def is_connected(self):
+        return self.guild.voice_client is self
+
+    def is_playing(self):
+        return self.source is not None and not self._paused
+
+    def is_paused(self):
+        return self.source is not None and self._paused
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def stop(self):
+        source, after = self.source, self._after
+        self.source = self._after = None
+        if source is not None:
+            source.cleanup()
+            if after is not None:
+                after(None)  # discord.py calls this from its player thread
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.guild.voice_client = None
+        self.guild.bot._connection._voice_clients.pop(self.guild.id, None)
+
+class FakeVoiceChannel:
+    def __init__(self, guild):
+        self.guild = guild
+        self.members = []
+
+    async def connect(self):
+        voice_client = NullVoiceClient(self.guild, self)
+        self.guild.voice_client = voice_client
+        self.guild.bot._connection._voice_clients[self.guild.id] = voice_client
+        return voice_client
+
+class FakeMessage:
+    _ids = itertools.count(int(time.time() * 1000 - 1420070400000) << 22)
+
+    def __init__(self, channel, author=None, content=''):
+        self.id = next(self._ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.raw_mentions = []
+        self.raw_role_mentions = []
+        self.mention_everyone = False
+        self._state = channel.guild.bot._connection  # for commands.Context
+
+    async def delete(self):
+        await asyncio.sleep(HTTP_SECONDS)
+
+class FakeTextChannel:
+    def __init__(self, guild, channel_id):
+        self.guild = guild
+        self.id = channel_id
+
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(HTTP_SECONDS)
+        return FakeMessage(self)
+
+class FakeMember:
+    def __init__(self, guild, member_id, voice_channel):
+        self.guild = guild
+        self.id = member_id
+        self.bot = False
+        self.mention = f'<@{member_id}>'
+        self.voice = SimpleNamespace(channel=voice_channel)
+        self.spammer = random.random() < SPAMMER_SHARE
+
+    def __str__(self):
+        return f'member{self.id}'
+
+    async def timeout(self, until, *, reason=None):
+        await asyncio.sleep(HTTP_SECONDS)
+
+    async def kick(self, *, reason=None):
+        await asyncio.sleep(HTTP_SECONDS)
+
+    async def ban(self, *, reason=None):
+        await asyncio.sleep(HTTP_SECONDS)
+
+class FakeGuild:
+    def __init__(self, bot, guild_id, members):
+        self.bot = bot
+        self.id = guild_id
+        self.name = f'guild{guild_id}'
+        self.voice_client = None
+        self.voice_channel = FakeVoiceChannel(self)
+        self.text_channel = FakeTextChannel(self, guild_id * 10)
+        self.members = [FakeMember(self, guild_id * 100_000 + index, self.voice_channel) for index in range(members)]
+
+class FakeResponse:
+    def __init__(self):
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, *, ephemeral=False, thinking=False):
+        self._done = True
+
+    async def send_message(self, content=None, **kwargs):
+        await asyncio.sleep(HTTP_SECONDS)
+        self._done = True
+
+    async def edit_message(self, **kwargs):
+        await asyncio.sleep(HTTP_SECONDS)
+        self._done = True
+
+class FakeFollowup:
+    async def send(self, content=None, **kwargs):
+        await asyncio.sleep(HTTP_SECONDS)
+
+class FakeInteraction:
+    def __init__(self, bot, guild, user):
+        self.client = bot
+        self.guild = guild
+        self.user = user
+        self.channel = guild.text_channel
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+    async def edit_original_response(self, **kwargs):
+        await asyncio.sleep(HTTP_SECONDS)
+
+class FakeHTTP:
+    # The REST calls DeleteQueue and PurgeJob make, answered after HTTP_SECONDS
+    async def delete_message(self, channel_id, message_id, *, reason=None):
+        await asyncio.sleep(HTTP_SECONDS)
+
+    async def delete_messages(self, channel_id, message_ids, *, reason=None):
+        await asyncio.sleep(HTTP_SECONDS)
+
+    async def logs_from(self, channel_id, limit, before=None, after=None, around=None):
+        await asyncio.sleep(HTTP_SECONDS)
+        newest = int(before) if before else next(FakeMessage._ids)
+        return [
+            {'id': str(newest - index - 1), 'author': {'id': '1'}, 'content': 'hi', 'attachments': []}
+            for index in range(limit)
+        ]
+
+def import_bot(directory):
+    os.environ.update(
+        INFRACTIONS_DB=os.path.join(directory, 'infractions.db'),
+        PROFANITY_DIR=os.path.join(directory, 'profanity'),
+        COMMAND_SYNC_FILE=os.path.join(directory, 'command_sync.json'),
+        AUDIO_CACHE_MAX_MB='0',
+        EXTRACTION_MODE='thread',
+    )
+    os.environ.pop('METRICS_PORT', None)
+    yt_dlp.YoutubeDL = StubYoutubeDL
+    discord.FFmpegOpusAudio = SilentAudio
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import discord_bot_complete
+    return discord_bot_complete
+
+# ---- Load generation ----
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.tasks = set()
+
+    def spawn(self, name, due, coro):
+        task = asyncio.create_task(self._timed(name, due, coro))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _timed(self, name, due, coro):
+        try:
+            await coro
+        except Exception:
+            if not self.errors[name]:
+                traceback.print_exc()  # the first failure of each handler
+            self.errors[name] += 1
+        self.latencies[name].append(time.perf_counter() - due)
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def song_query():
+    # Zipf-like popularity: a few songs get most of the requests
+    return f'song {int(CATALOG ** random.random()) - 1}'
+
+def command(bot, guild):
+    music, moderation = bot.get_cog('Music'), bot.get_cog('Moderation')
+    member = random.choice(guild.members)
+    interaction = FakeInteraction(bot, guild, member)
+    roll = random.random()
+    if roll < 0.40:
+        return 'play', music.play.callback(music, interaction, song_query())
+    if roll < 0.55:
+        return 'queue', music.show_queue.callback(music, interaction)
+    if roll < 0.80:
+        view = bot.persistent_view
+        button = random.choice((view.pause_button, view.resume_button, view.skip_button, view.skip_button, view.stop_button))
+        return 'button', button.callback(interaction)
+    if roll < 0.90:
+        return 'warnings', moderation.check_warnings.callback(moderation, interaction, random.choice(guild.members))
+    if roll < 0.98:
+        return 'timeout', moderation.timeout.callback(moderation, interaction, random.choice(guild.members), 10)
+    if interaction.channel.id in moderation.active_purges:
+        return 'warnings', moderation.check_warnings.callback(moderation, interaction, member)
+    return 'purge', moderation.purge.callback(moderation, interaction, 200)
+
+def message(bot, guild):
+    member = random.choice(guild.members)
+    if random.random() < PROFANE_SHARE:
+        content = 'what the fuck'
+    elif member.spammer:
+        content = 'join my server discord.gg/raid'
+    else:
+        content = f'hello there {random.randrange(1_000_000)}'
+    return bot.get_cog('Moderation').on_message(FakeMessage(guild.text_channel, member, content))
+
+async def run(options, bot_module):
+    bot = bot_module.bot
+    await bot._async_setup_hook()  # the event loop and ready flag login() would set up
+    bot._connection.user = SimpleNamespace(id=1, bot=True)
+    bot.deletes.http = FakeHTTP()
+    bot.http.logs_from = FakeHTTP().logs_from
+    bot.http.delete_messages = FakeHTTP().delete_messages
+    bot.http.delete_message = FakeHTTP().delete_message
+    await bot.infractions.open()
+    bot.scheduler.start()
+    bot.watchdog.start()
+    for extension in bot_module.EXTENSIONS:
+        await bot.load_extension(extension)
+    bot._ready.set()
+    await bot.get_cog('Moderation').profanity_task  # compiled before the clock starts
+    bot.persistent_view = sys.modules['cogs.music'].MusicControlView()
+
+    guilds = [FakeGuild(bot, guild_id, options.members) for guild_id in range(1, options.guilds + 1)]
+    recorder = Recorder()
+    events_per_second = options.messages + options.commands
+    command_share = options.commands / events_per_second
+    interval = 0.01
+    per_tick = events_per_second * interval
+    gc.collect()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    owed = 0.0
+    ticks = int(options.seconds / interval)
+    for tick in range(ticks):
+        due = start + tick * interval
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        owed += per_tick
+        while owed >= 1:
+            owed -= 1
+            guild = random.choice(guilds)
+            if random.random() < command_share:
+                name, coro = command(bot, guild)
+            else:
+                name, coro = 'on_message', message(bot, guild)
+            recorder.spawn(name, due, coro)
+    generated = time.perf_counter() - start
+    if recorder.tasks:
+        await asyncio.wait(recorder.tasks, timeout=30)
+    elapsed = time.perf_counter() - start
+
+    for queue in bot.music_queues.values():
+        queue.clear()
+    for task in asyncio.all_tasks() - {asyncio.current_task()}:
+        if task.get_coro().__name__ in ('prefetch_next', '_report'):
+            task.cancel()
+    for extension in bot_module.EXTENSIONS:
+        await bot.unload_extension(extension)
+    bot.watchdog.stop()
+    await bot.scheduler.stop()
+    await bot.deletes.close()
+    await bot.infractions.close()
+    return recorder, generated, elapsed, rss_before
+
+def report(options, bot, recorder, generated, elapsed, rss_before):
+    handled = sum(len(latencies) for latencies in recorder.latencies.values())
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        rss *= 1024
+        rss_before *= 1024
+    print(
+        f'{options.guilds} servers, {options.messages} messages/s + {options.commands} commands/s '
+        f'for {options.seconds:g}s ({EXTRACT_SECONDS * 1000:g} ms lookups, {HTTP_SECONDS * 1000:g} ms REST)\\n'
+    )
+    print(f'{"handler":<12} {"count":>7} {"errors":>7} {"p50 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    worst = 0.0
+    for name in sorted(recorder.latencies):
+        ordered = sorted(recorder.latencies[name])
+        p99 = percentile(ordered, 99)
+        worst = max(worst, p99)
+        print(
+            f'{name:<12} {len(ordered):7} {recorder.errors[name]:7} {percentile(ordered, 50) * 1000:8.1f} '
+            f'{p99 * 1000:8.1f} {ordered[-1] * 1000:8.1f}'
+        )
+    print(
+        f'\\nthroughput {handled / elapsed:,.0f} events/s (generated over {generated:.1f}s, all done after {elapsed:.1f}s)'
+        f'\\npeak RSS {rss / 1e6:.0f} MB ({(rss - rss_before) / 1e6:+.0f} MB during the run)'
+        f'\\nevent loop: max lag {bot.watchdog.max_lag * 1000:.0f} ms, {bot.watchdog.stalls} stalls over '
+        f'{bot.watchdog.threshold * 1000:g} ms'
+    )
+    for offender in bot.watchdog.worst():
+        print(f'  {offender.total * 1000:7.0f} ms in {offender.stalls} stalls  {offender.location}')
+    return worst
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test of the bot handlers')
+    parser.add_argument('--guilds', type=int, default=100)
+    parser.add_argument('--members', type=int, default=50, help='members per server')
+    parser.add_argument('--messages', type=int, default=1000, help='chat messages per second')
+    parser.add_argument('--commands', type=int, default=50, help='slash commands and button clicks per second')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--max-p99', type=float, help='exit with 1 if any handler p99 is above this many ms')
+    options = parser.parse_args()
+    random.seed(options.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot_module = import_bot(directory)
+        results = asyncio.run(run(options, bot_module))
+    worst = report(options, bot_module.bot, *results)
+    if options.max_p99 is not None and worst * 1000 > options.max_p99:
+        sys.exit(f'\\np99 {worst * 1000:.1f} ms is above --max-p99 {options.max_p99:g} ms')
+
+if __name__ == '__main__':
+    main()
+"""
+
+# Startup time: imports, setup_hook and loading deferred until READY
+
+bench_startup_code = """
+# Startup time benchmark
+# Starts the bot in fresh Python processes and times each step up to the
+# point where it would connect, and what runs after the gateway is ready:
+# importing discord.py, importing the bot (its own modules and building the
+# client), setup_hook with each extension it loads, and the work deferred
+# until READY (the profanity word list and yt-dlp). Login and the gateway
+# handshake are network round trips and aren't part of it; slash commands
+# aren't sent anywhere either. The bot's files go to a temporary directory.
+# Run from the directory the bot was generated into: python bench_startup.py [--runs 5]
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# ---- One bot start, in a child process ----
+
+def child():
+    started = time.perf_counter()
+    phases = {}
+    import discord
+    from discord.ext import commands
+    phases['import discord.py'] = time.perf_counter() - started
+
+    mark = time.perf_counter()
+    sys.path.insert(0, HERE)
+    import discord_bot_complete
+    phases['import bot'] = time.perf_counter() - mark
+
+    connect, loaded = asyncio.run(start(discord_bot_complete.bot))
+    phases.update(connect)
+    phases['total'] = time.perf_counter() - started
+    print('RESULT ' + json.dumps({'phases': phases, 'imported': loaded}))
+
+async def start(bot):
+    phases = {}
+
+    async def no_sync(guild=None):
+        return []
+
+    load_extension = bot.load_extension
+
+    async def timed_load(name, **kwargs):
+        mark = time.perf_counter()
+        await load_extension(name, **kwargs)
+        phases[f'  {name}'] = time.perf_counter() - mark
+
+    bot.tree.sync = no_sync
+    bot.load_extension = timed_load
+    phases['setup_hook'] = 0.0  # listed before the extensions it loads
+    mark = time.perf_counter()
+    await bot._async_setup_hook()  # what login() does before setup_hook
+    await bot.setup_hook()
+    phases['setup_hook'] = time.perf_counter() - mark
+    loaded = [name for name in ('yt_dlp', 'better_profanity') if name in sys.modules]
+
+    # The gateway would connect here; READY lets the deferred loading start
+    ready = time.perf_counter()
+    bot.watchdog.max_lag = 0.0
+    bot._ready.set()
+    deferred = {
+        'after READY: profanity list': bot.get_cog('Moderation').profanity_task,
+        'after READY: yt-dlp import': bot.get_cog('Music').warmup_task,
+    }
+    for name, task in deferred.items():
+        task.add_done_callback(lambda task, name=name: phases.__setitem__(name, time.perf_counter() - ready))
+    await asyncio.gather(*deferred.values())
+    await asyncio.sleep(0)  # let the done callbacks run
+    phases['after READY: max loop lag'] = bot.watchdog.max_lag
+    await bot.close()
+    return phases, loaded
+
+# ---- Driver ----
+
+def run_once(directory):
+    env = dict(
+        os.environ,
+        INFRACTIONS_DB=os.path.join(directory, 'infractions.db'),
+        PROFANITY_DIR=os.path.join(directory, 'profanity'),
+        COMMAND_SYNC_FILE=os.path.join(directory, 'command_sync.json'),
+        AUDIO_CACHE_DIR=os.path.join(directory, 'audio_cache'),
+        SNAPSHOT_FILE=os.path.join(directory, 'queues.snapshot.json'),
+        SONG_INDEX_FILE=os.path.join(directory, 'song_index.json'),
+        METRICS_PORT='0',
+    )
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child'],
+        cwd=directory, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    wall = time.perf_counter() - started
+    for line in output.splitlines():
+        if line.startswith('RESULT '):
+            result = json.loads(line[len('RESULT '):])
+            result['phases']['process wall time'] = wall
+            return result
+    raise RuntimeError(f'The child process printed no result:\\n{output}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Bot startup time, import versus setup and deferred loading')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+    if options.child:
+        child()
+        return
+
+    results = []
+    for _ in range(options.runs):
+        with tempfile.TemporaryDirectory() as directory:
+            results.append(run_once(directory))
+
+    print(f'{options.runs} cold starts, each in a new process\\n')
+    print(f'{"step":<34} {"median ms":>10} {"max ms":>8}')
+    for name in results[0]['phases']:
+        values = [result['phases'][name] * 1000 for result in results]
+        print(f'{name:<34} {statistics.median(values):10.1f} {max(values):8.1f}')
+    imported = sorted({name for result in results for name in result['imported']})
+    print(f'\\nimported before connecting: {", ".join(imported) if imported else "neither yt_dlp nor better_profanity"}')
+
+if __name__ == '__main__':
+    main()
+"""
+
+# Save to files next to the generated bot
+benchmarks = {
+    'bench_music_queue.py': bench_music_queue_code,
+    'bench_profanity.py': bench_profanity_code,
+    'bench_infractions.py': bench_infractions_code,
+    'bench_delete_queue.py': bench_delete_queue_code,
+    'bench_purge.py': bench_purge_code,
+    'bench_audio.py': bench_audio_code,
+    'bench_load.py': bench_load_code,
+    'bench_startup.py': bench_startup_code,
+}
+
+for filename, code in benchmarks.items():
+    with open(f'/tmp/{filename}', 'w') as f:
+        f.write(code)
+
+print("✅ Created benchmark scripts:")
+for filename in benchmarks:
+    print(f"   - {filename}")